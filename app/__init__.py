@@ -0,0 +1,4 @@
+# app/__init__.py
+# Loaded before any submodule: config sets OMP_NUM_THREADS, which must
+# happen before faiss / torch are imported.
+from . import config  # noqa: F401
@@ -1,9 +1,12 @@
 # app/api.py
 from __future__ import annotations
 
+import shutil
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import List
 
+from async_lru import alru_cache
 from fastapi import (
     FastAPI,
     UploadFile,
@@ -15,17 +18,41 @@ from fastapi import (
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 from starlette.templating import Jinja2Templates
 
 from .config import BASE_DIR, KNOWLEDGE_DIR
 from .vector_store import (
+    count_documents_in_vector_store,
+    get_index_epoch,
     get_vector_store,
     get_vector_store_info,
+    search_questions,
 )
 from .ingest import ingest_path, ingest_directory
+from .query_batcher import QueryBatcher
 
-app = FastAPI(title="Study RAG Service")
+# Concurrent /query calls share encoder forward passes and FAISS searches.
+query_batcher = QueryBatcher(search_questions, max_batch_size=32, max_wait_ms=8.0)
+
+QUERY_CACHE_SIZE = 1024
+
+# Upper bound on top-k. Queries are searched in shared batches at the
+# batch's largest k, so one oversized k would cost every request in it.
+MAX_K = 100
+
+# Uploads are streamed to disk in blocks of this size.
+UPLOAD_COPY_BUFSIZE = 1024 * 1024
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await query_batcher.stop()
+
+
+app = FastAPI(title="Study RAG Service", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -64,7 +91,7 @@ class IngestResponse(BaseModel):
 
 class QueryRequest(BaseModel):
     question: str
-    k: int = 5
+    k: int = Field(5, ge=1, le=MAX_K)
 
 
 class RetrievedChunk(BaseModel):
@@ -81,18 +108,33 @@ class QueryResponse(BaseModel):
 # ---------- Core RAG logic ----------
 
 
-def run_rag_query(question: str, k: int = 5) -> QueryResponse:
+async def run_rag_query(question: str, k: int = 5) -> QueryResponse:
     """
     Simple retrieval-only RAG:
-    - searches FAISS
+    - embeds the question and searches FAISS, micro-batched with
+      concurrent queries
     - returns top-k chunks
     - 'answer' is just a stitched view of those chunks
 
+    Results are cached per (stripped question, k) until the index
+    changes, so UI retries and repeated questions do no work. Case is
+    kept: bge-m3's tokenizer is cased, so "MCP" and "mcp" can retrieve
+    different chunks.
+
     Project 2 (Copilot) will call this via /query and then hand off
     to an LLM for summarization / reasoning.
     """
-    vs = get_vector_store()
-    docs = vs.similarity_search(question, k=k)
+    return await _cached_rag_query(question.strip(), k, get_index_epoch())
+
+
+@alru_cache(maxsize=QUERY_CACHE_SIZE)
+async def _cached_rag_query(question: str, k: int, epoch: int) -> QueryResponse:
+    # `epoch` is only part of the cache key: adding documents bumps it,
+    # so stale entries are never hit again and age out of the LRU.
+    vs = await run_in_threadpool(get_vector_store)
+    docs = []
+    if count_documents_in_vector_store(vs):
+        docs = await query_batcher.search(question, k)
 
     if not docs:
         return QueryResponse(
@@ -100,7 +142,7 @@ def run_rag_query(question: str, k: int = 5) -> QueryResponse:
             retrieved=[],
         )
 
-    context_snippets: List[str] = []
+    parts: List[str] = ["Top matching chunks from your library:\n\n"]
     retrieved: List[RetrievedChunk] = []
 
     for i, d in enumerate(docs, start=1):
@@ -108,7 +150,7 @@ def run_rag_query(question: str, k: int = 5) -> QueryResponse:
         chunk_id = int(d.metadata.get("chunk_id", 0))
         text = (d.page_content or "").strip()
 
-        context_snippets.append(f"[{i}] {text}")
+        parts.append(f"[{i}] {text}\n\n")
         retrieved.append(
             RetrievedChunk(
                 source=src,
@@ -117,15 +159,23 @@ def run_rag_query(question: str, k: int = 5) -> QueryResponse:
             )
         )
 
-    answer = (
-        "Top matching chunks from your library:\n\n"
-        + "\n\n".join(context_snippets)
-        + "\n\n(Next step: call an LLM service to turn this into a narrative answer.)"
+    # One join for the whole answer instead of concatenating pieces.
+    parts.append(
+        "(Next step: call an LLM service to turn this into a narrative answer.)"
     )
+    answer = "".join(parts)
 
     return QueryResponse(answer=answer, retrieved=retrieved)
 
 
+def _save_upload(file: UploadFile, dest: Path) -> None:
+    """
+    Stream an upload to disk without holding the whole file in memory.
+    """
+    with dest.open("wb") as f:
+        shutil.copyfileobj(file.file, f, length=UPLOAD_COPY_BUFSIZE)
+
+
 # ---------- JSON API endpoints ----------
 
 
@@ -168,9 +218,7 @@ async def ingest_upload(file: UploadFile = File(...)):
     KNOWLEDGE_DIR.mkdir(parents=True, exist_ok=True)
     dest = KNOWLEDGE_DIR / file.filename
 
-    with dest.open("wb") as f:
-        content = await file.read()
-        f.write(content)
+    await run_in_threadpool(_save_upload, file, dest)
 
     count = ingest_path(dest)
     return IngestResponse(
@@ -180,8 +228,8 @@ async def ingest_upload(file: UploadFile = File(...)):
 
 
 @app.post("/query", response_model=QueryResponse)
-def query(body: QueryRequest):
-    return run_rag_query(body.question, body.k)
+async def query(body: QueryRequest):
+    return await run_rag_query(body.question, body.k)
 
 
 # ---------- HTML UI endpoints ----------
@@ -208,9 +256,7 @@ async def ui_upload(request: Request, file: UploadFile = File(...)):
     KNOWLEDGE_DIR.mkdir(parents=True, exist_ok=True)
     dest = KNOWLEDGE_DIR / file.filename
 
-    with dest.open("wb") as f:
-        content = await file.read()
-        f.write(content)
+    await run_in_threadpool(_save_upload, file, dest)
 
     chunks = ingest_path(dest)
     status = get_vector_store_info()
@@ -276,10 +322,10 @@ async def ui_ingest_path(request: Request, path: str = Form(...)):
 async def ui_query(
     request: Request,
     question: str = Form(...),
-    k: int = Form(5),
+    k: int = Form(5, ge=1, le=MAX_K),
 ):
     status = get_vector_store_info()
-    result = run_rag_query(question, k)
+    result = await run_rag_query(question, k)
 
     return templates.TemplateResponse(
         "index.html",
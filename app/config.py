@@ -15,3 +15,32 @@ VECTOR_DIR = BASE_DIR / "data" / "vector_store"
 EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-m3")
 EMBED_DIM = int(os.getenv("EMBED_DIM", "1024"))
 EMBED_DEVICE = os.getenv("EMBED_DEVICE", "cuda")  # "cuda" or "cpu"
+
+
+def effective_cpu_count() -> int:
+    """
+    CPUs this process can actually run on: the scheduler affinity mask,
+    capped by the cgroup v2 CPU quota when the container sets one.
+    os.cpu_count() reports the host's CPUs and ignores both.
+    """
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS / Windows
+        n = os.cpu_count() or 1
+
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            n = min(n, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return n
+
+
+# Thread budget for FAISS, ONNX Runtime / torch and our worker pools
+CPU_COUNT = effective_cpu_count()
+
+# OpenMP reads this when the runtime loads, so it has to be set before
+# faiss (and torch behind the HF embedder) is imported; app/__init__.py
+# imports this module first for that reason.
+os.environ.setdefault("OMP_NUM_THREADS", str(CPU_COUNT))
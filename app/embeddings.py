@@ -0,0 +1,111 @@
+# app/embeddings.py
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .config import CPU_COUNT
+
+# Must be set before `tokenizers` is imported to take effect.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    LangChain embeddings client running an INT8-quantized ONNX export of
+    the encoder through ONNX Runtime on CPU.
+
+    The default model (Xenova/bge-m3) is the same BAAI/bge-m3 network,
+    so vectors stay compatible with indexes built by the HF backend.
+    bge-m3 uses the [CLS] token as its sentence embedding; pass
+    pooling="mean" for models trained with mean pooling.
+
+    Batch i+1 is tokenized on a single prefetch thread while batch i
+    runs through the ONNX session (the Rust fast tokenizer releases the
+    GIL). One thread only: a fast tokenizer must not be called from two
+    threads at once, and each call already fans out internally.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        file_name: str = "model_quantized.onnx",
+        subfolder: str = "onnx",
+        batch_size: int = 64,
+        max_length: int = 512,
+        pooling: str = "cls",
+    ) -> None:
+        # Imported lazily so the HF backend works without optimum installed.
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        # ORT's thread pool ignores OMP_NUM_THREADS and defaults to the
+        # host's cores; keep it within the container's CPU budget.
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = CPU_COUNT
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_id,
+            subfolder=subfolder,
+            file_name=file_name,
+            provider="CPUExecutionProvider",
+            session_options=session_options,
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.pooling = pooling
+        self._tokenize_pool = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="tokenize",
+        )
+
+    def _tokenize(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        return self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+
+    def _encode_batch(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        hidden = self.model(**inputs).last_hidden_state
+
+        if self.pooling == "mean":
+            mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+        else:
+            pooled = hidden[:, 0]
+
+        return pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:  # type: ignore[override]
+        """
+        Returns a C-contiguous float32 (n, dim) array rather than nested
+        lists, so FAISS can take it without a per-element conversion.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        slices = [
+            texts[i : i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        batches: List[np.ndarray] = []
+        pending = self._tokenize_pool.submit(self._tokenize, slices[0])
+        for j in range(len(slices)):
+            inputs = pending.result()
+            if j + 1 < len(slices):
+                pending = self._tokenize_pool.submit(self._tokenize, slices[j + 1])
+            batches.append(self._encode_batch(inputs))
+        return np.ascontiguousarray(np.concatenate(batches), dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:  # type: ignore[override]
+        return self.embed_documents([text])[0]
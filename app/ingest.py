@@ -1,83 +1,285 @@
 # app/ingest.py
 from __future__ import annotations
 
+import gc
+import json
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Tuple
 
+import pypdfium2 as pdfium
+import xxhash
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from semantic_text_splitter import TextSplitter
 
-from .config import KNOWLEDGE_DIR
+from .config import CPU_COUNT, KNOWLEDGE_DIR
 from .vector_store import (
+    VECTOR_DIR,
     get_vector_store,
     add_documents_to_vector_store,
+    count_documents_in_vector_store,
+    save_vector_store,
 )
 
 # Chunking config: tune as needed.
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 
+# Streaming config: how much text to buffer before splitting, and how
+# many chunks to embed + add per vector store call.
+STREAM_BUFFER_SIZE = CHUNK_SIZE * 16
+INGEST_BATCH_SIZE = 256
+
+SUPPORTED_SUFFIXES = (".txt", ".md", ".pdf")
+
+# Sidecar recording each ingested file's mtime and content hash, so
+# directory re-ingests skip files that have not changed.
+INGESTED_FILE = VECTOR_DIR / "ingested.json"
+HASH_READ_SIZE = 1024 * 1024
+
+# PDFium keeps process-global state and must not be entered from two
+# threads at once; directory ingest workers are separate processes.
+_pdfium_lock = threading.Lock()
+
+# Built once: construction parses config and allocates native state.
+_splitter = TextSplitter(CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+
 
 def _read_text_file(path: Path) -> str:
     return path.read_text(encoding="utf-8", errors="ignore")
 
 
-def _read_pdf_file(path: Path) -> str:
-    """
-    Simple PDF reader using pypdf: concatenates all page texts.
+def _iter_pdf_pages(path: Path) -> Iterator[str]:
     """
-    from pypdf import PdfReader  # ensure pypdf is in requirements
+    PDF reader using pypdfium2 (Google's C++ PDFium): yields one page's
+    text at a time, so the whole document never sits in memory as a
+    single string. Each page is closed as soon as its text is out.
 
-    reader = PdfReader(str(path))
-    texts: List[str] = []
-    for page in reader.pages:
-        texts.append(page.extract_text() or "")
-    return "\n".join(texts)
+    PDFium is not thread-safe, and single-file ingests run in the API's
+    threadpool, so every call into it holds _pdfium_lock.
+    """
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(str(path))
+        n_pages = len(pdf)
+    try:
+        for i in range(n_pages):
+            # The lock is released before yielding, so a slow consumer
+            # never holds up another thread's PDF.
+            with _pdfium_lock:
+                page = pdf[i]
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+            # PDFium ends lines with CRLF; match the text files' "\n".
+            yield text.replace("\r\n", "\n")
+    finally:
+        with _pdfium_lock:
+            pdf.close()
 
 
 def _split_text(text: str) -> List[str]:
     """
     Chunk raw text into overlapping segments.
 
-    Uses RecursiveCharacterTextSplitter so we split on paragraphs/lines/words
-    before falling back to raw characters. That gives nicer chunks for RAG
-    and lets the embedding model do less pointless work.
+    Uses semantic-text-splitter (Rust, via PyO3), which splits on the
+    largest semantic unit that fits: paragraphs, then lines, sentences,
+    words and finally characters. Same chunk shape as LangChain's
+    RecursiveCharacterTextSplitter, at native speed.
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", " ", ""],
-    )
-    return splitter.split_text(text)
+    return _splitter.chunks(text)
 
 
-def load_file_as_documents(path: Path) -> List[Document]:
+def _iter_chunks(pieces: Iterable[str]) -> Iterator[str]:
     """
-    Load a single file (.txt, .md, .pdf) into a list of LangChain Documents.
+    Streaming wrapper around _split_text.
+
+    Pieces (e.g. PDF pages) are joined with newlines into a bounded
+    buffer. Once the buffer is large enough it is split, and every chunk
+    except the last is emitted; the last one may still continue into the
+    next piece, so it is carried over and re-split with it.
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer = f"{buffer}\n{piece}" if buffer else piece
+        if len(buffer) < STREAM_BUFFER_SIZE:
+            continue
+        chunks = _split_text(buffer)
+        yield from chunks[:-1]
+        buffer = chunks[-1] if chunks else ""
+
+    if buffer:
+        yield from _split_text(buffer)
+
+
+def iter_file_documents(path: Path) -> Iterator[Document]:
+    """
+    Stream a single file (.txt, .md, .pdf) as LangChain Documents.
     """
     suffix = path.suffix.lower()
     if suffix in [".txt", ".md"]:
-        raw = _read_text_file(path)
+        pieces: Iterable[str] = [_read_text_file(path)]
     elif suffix == ".pdf":
-        raw = _read_pdf_file(path)
+        pieces = _iter_pdf_pages(path)
     else:
         raise ValueError(f"Unsupported file type: {suffix}")
 
-    chunks = _split_text(raw)
-    docs: List[Document] = []
-    for i, chunk in enumerate(chunks):
+    source = str(path.relative_to(KNOWLEDGE_DIR))
+    for i, chunk in enumerate(_iter_chunks(pieces)):
         if not chunk.strip():
             continue
-        docs.append(
-            Document(
-                page_content=chunk,
-                metadata={
-                    "source": str(path.relative_to(KNOWLEDGE_DIR)),
-                    "chunk_id": i,
-                },
-            )
+        yield Document(
+            page_content=chunk,
+            metadata={
+                "source": source,
+                "chunk_id": i,
+            },
         )
-    return docs
+
+
+def load_file_as_documents(path: Path) -> List[Document]:
+    """
+    Load a single file (.txt, .md, .pdf) into a list of LangChain Documents.
+    """
+    return list(iter_file_documents(path))
+
+
+def _add_in_batches(documents: Iterable[Document]) -> int:
+    """
+    Add a stream of Documents to the vector store INGEST_BATCH_SIZE at a
+    time, then flush to disk. Returns number of chunks added, which
+    excludes chunks the store already held.
+    """
+    vs = get_vector_store()
+    before = count_documents_in_vector_store(vs)
+    batch: List[Document] = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= INGEST_BATCH_SIZE:
+            add_documents_to_vector_store(vs=vs, documents=batch, persist=False)
+            batch = []
+
+    if batch:
+        add_documents_to_vector_store(vs=vs, documents=batch, persist=False)
+
+    total = count_documents_in_vector_store(vs) - before
+    if total:
+        save_vector_store(vs)
+    return total
+
+
+def _iter_files(root: Path) -> Iterator[os.DirEntry]:
+    """
+    Walk root with os.scandir, yielding supported files. DirEntry caches
+    the type (and later stat) info scandir already fetched.
+    """
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(
+                    SUPPORTED_SUFFIXES
+                ):
+                    yield entry
+
+
+def _hash_file(path: Path) -> str:
+    h = xxhash.xxh3_64()
+    with path.open("rb") as f:
+        while block := f.read(HASH_READ_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_ingested() -> Dict[str, Dict[str, Any]]:
+    if not INGESTED_FILE.exists():
+        return {}
+    return json.loads(INGESTED_FILE.read_text(encoding="utf-8"))
+
+
+def _save_ingested(ingested: Dict[str, Dict[str, Any]]) -> None:
+    INGESTED_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = INGESTED_FILE.with_name(INGESTED_FILE.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(ingested, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, INGESTED_FILE)
+
+
+def _select_changed_files(
+    entries: Iterable[os.DirEntry],
+    ingested: Dict[str, Dict[str, Any]],
+) -> Tuple[List[Path], Dict[str, Dict[str, Any]]]:
+    """
+    Split out the files that need (re-)ingesting.
+
+    A file is unchanged if its mtime matches the recorded one, or failing
+    that, if its content hash does. Returns the changed files plus the
+    sidecar entries to record once they are safely in the index.
+    """
+    files: List[Path] = []
+    updates: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        path = Path(entry.path)
+        key = str(path.relative_to(KNOWLEDGE_DIR))
+        mtime_ns = entry.stat().st_mtime_ns
+        seen = ingested.get(key)
+        if seen is not None and seen["mtime_ns"] == mtime_ns:
+            continue
+
+        digest = _hash_file(path)
+        updates[key] = {"mtime_ns": mtime_ns, "xxh3_64": digest}
+        if seen is None or seen["xxh3_64"] != digest:
+            files.append(path)
+    return files, updates
+
+
+def _iter_parsed_documents(files: List[Path]) -> Iterator[Document]:
+    """
+    Parse files in a process pool and yield their Documents in file
+    order.
+
+    Parsing is single-core per file, so running it in worker processes
+    keeps the embedding model in this process fed instead of stalled.
+    At most 2 x workers files are in flight, and a file's Documents are
+    dropped once yielded, so parsed results cannot pile up in memory
+    while the embedder lags behind.
+    """
+    if not files:
+        return
+
+    workers = min(len(files), max(1, CPU_COUNT - 1))
+    max_in_flight = 2 * workers
+    remaining = iter(files)
+    pending: Deque[Future] = deque()
+    # spawn, not fork: the parent may already be running model threads.
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        while True:
+            while len(pending) < max_in_flight:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                pending.append(ex.submit(load_file_as_documents, path))
+            if not pending:
+                break
+
+            # Oldest first, so the order of the batches doesn't depend on
+            # which worker finishes first.
+            docs = pending.popleft().result()
+            yield from docs
+            # Release the finished file's Documents before the next one.
+            del docs
+            gc.collect()
 
 
 def ingest_path(path: Path) -> int:
@@ -85,21 +287,31 @@ def ingest_path(path: Path) -> int:
     Ingest a single file into the vector store.
     Returns number of chunks added.
     """
-    vs = get_vector_store()
-    docs = load_file_as_documents(path)
-    add_documents_to_vector_store(vs=vs, documents=docs, persist=True)
-    return len(docs)
+    return _add_in_batches(iter_file_documents(path))
 
 
 def ingest_directory(root: Path) -> int:
     """
     Recursively ingest all supported files under a directory.
+
+    Files already ingested with the same content are skipped. The rest
+    are submitted smallest first (deterministic order; small files fill
+    the early batches) to parallel worker processes, while this process
+    embeds their chunks in shared batches. The index is persisted once,
+    after the whole directory, and the ingested-files record after it.
     """
-    total = 0
-    for p in root.rglob("*"):
-        if not p.is_file():
-            continue
-        if p.suffix.lower() not in [".txt", ".md", ".pdf"]:
-            continue
-        total += ingest_path(p)
-    return total
+    vs = get_vector_store()
+    # A fresh or recreated store holds none of the recorded files.
+    ingested = _load_ingested() if count_documents_in_vector_store(vs) else {}
+
+    entries = sorted(_iter_files(root), key=lambda e: (e.stat().st_size, e.path))
+    files, updates = _select_changed_files(entries, ingested)
+    if len(files) < len(entries):
+        print(f"[ingest] Skipping {len(entries) - len(files)} unchanged files.")
+
+    count = _add_in_batches(_iter_parsed_documents(files))
+
+    if updates:
+        ingested.update(updates)
+        _save_ingested(ingested)
+    return count
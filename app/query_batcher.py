@@ -0,0 +1,106 @@
+# app/query_batcher.py
+from __future__ import annotations
+
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from starlette.concurrency import run_in_threadpool
+
+# (questions, k) -> top-k Documents per question
+SearchFn = Callable[[List[str], int], List[List[Document]]]
+
+_Pending = Tuple[str, int, asyncio.Future]
+
+
+class QueryBatcher:
+    """
+    Micro-batcher for retrieval queries.
+
+    Questions arriving within a short window are embedded with a single
+    encoder call and searched with a single FAISS call, instead of one
+    of each per request. A request waits at most max_wait_ms for company
+    before its batch is sent.
+    """
+
+    def __init__(
+        self,
+        search_fn: SearchFn,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 8.0,
+    ) -> None:
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue[_Pending]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def search(self, question: str, k: int = 5) -> List[Document]:
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((question, k, future))
+        return await future
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _next_batch(self) -> List[_Pending]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _search_singly(self, batch: List[_Pending]) -> None:
+        for question, k, future in batch:
+            try:
+                results = await run_in_threadpool(self.search_fn, [question], k)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(results[0])
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            # One search at the largest k; smaller requests take a prefix.
+            k_max = max(k for _, k, _ in batch)
+            try:
+                results = await run_in_threadpool(
+                    self.search_fn, [q for q, _, _ in batch], k_max
+                )
+            except Exception as e:
+                if len(batch) == 1:
+                    _, _, future = batch[0]
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                # Retry one by one so a single bad request (e.g. an
+                # invalid k) fails alone instead of taking its batch down.
+                await self._search_singly(batch)
+                continue
+
+            for (_, k, future), docs in zip(batch, results):
+                if not future.done():
+                    future.set_result(docs[:k])
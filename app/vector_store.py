@@ -1,18 +1,34 @@
 from __future__ import annotations
 
+import atexit
+import json
 import os
+import pickle
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
 
 import faiss
+import numpy as np
+import xxhash
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from .config import CPU_COUNT
+from .embeddings import OnnxEmbeddings
 
 # Base paths
 VECTOR_DIR = Path("data/vector_store")
 INDEX_DIR = VECTOR_DIR  # FAISS.save_local / load_local use a directory
+# Same file names and formats as FAISS.save_local / load_local
+INDEX_FILE = INDEX_DIR / "index.faiss"
+DOCSTORE_FILE = INDEX_DIR / "index.pkl"
+# xxh3-64 of each stored chunk's text -> {source: index position}
+CHUNK_HASHES_FILE = INDEX_DIR / "chunk_hashes.json"
 
 # Embedding model config
 DEFAULT_EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-m3")
@@ -21,13 +37,75 @@ DEFAULT_EMBED_DIM = int(os.getenv("EMBED_DIM", "1024"))
 # We are intentionally CPU-only inside this container
 EMBED_DEVICE = "cpu"
 
-_embeddings: Optional[HuggingFaceEmbeddings] = None
+# "onnx" (default): INT8-quantized ONNX export via ONNX Runtime.
+# "hf": fp32 sentence-transformers via langchain-huggingface.
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "onnx").lower()
+ONNX_EMBED_MODEL = os.getenv("ONNX_EMBED_MODEL", "Xenova/bge-m3")
+ONNX_EMBED_FILE = os.getenv("ONNX_EMBED_FILE", "model_quantized.onnx")
+EMBED_BATCH_SIZE = 64
+
+# FAISS index layout for new stores: "hnsw" (default), "ivfpq",
+# "pqfastscan", "sqfp16" (exact scan over fp16 vectors) or "flat".
+# Embeddings are L2-normalized, so all layouts use inner product (= cosine).
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "hnsw").lower()
+
+# HNSW graph parameters
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# IVF-PQ parameters. The PQ index must be trained before it can hold
+# vectors, so we stage into an fp16 index until IVFPQ_TRAIN_SIZE vectors
+# exist, then train on those and move everything across.
+IVF_NLIST = 1024
+IVF_NPROBE = 16
+IVFPQ_NBITS = 8
+IVFPQ_TRAIN_SIZE = 10_000
+
+# PQ FastScan parameters: 4-bit codes let FAISS scan 32 vectors per SIMD
+# lookup-table shuffle. Staged and trained like IVF-PQ above.
+PQFS_NBITS = 4
+PQFS_TRAIN_SIZE = 2048
+
+# Minimum number of staged vectors before each trained layout is built.
+_TRAIN_SIZES = {
+    "ivfpq": IVFPQ_TRAIN_SIZE,
+    "pqfastscan": PQFS_TRAIN_SIZE,
+}
+
+# Let FAISS spread searches across every core the container grants us;
+# OpenMP's own default can see the host's CPUs instead.
+faiss.omp_set_num_threads(CPU_COUNT)
+
+# Memory-map the index on load instead of reading it into RAM, so
+# several uvicorn workers can share one copy via the page cache.
+# FAISS_MMAP=0 disables this.
+INDEX_MMAP = os.getenv("FAISS_MMAP", "1") != "0"
+
+# Saving rewrites the whole index, so unforced saves are debounced until
+# this many documents have been added since the last one.
+PERSIST_EVERY = 1024
+
+_embeddings: Optional[Embeddings] = None
 _vector_store: Optional[FAISS] = None
-
-
-def _get_embeddings() -> HuggingFaceEmbeddings:
+# True while _vector_store.index is a read-only mapping of INDEX_FILE
+_index_is_mmapped = False
+# Documents added since the last save
+_dirty_count = 0
+# Text hash -> {source: index position} for every chunk in _vector_store, so
+# re-ingested chunks are skipped and shared texts are never re-embedded
+_chunk_hashes: Dict[str, Dict[str, int]] = {}
+# Bumped whenever the index contents change; lets callers key caches on it
+_index_epoch = 0
+
+
+def _get_embeddings() -> Embeddings:
     """
-    Singleton HF embeddings client (BAAI/bge-m3 by default).
+    Singleton embeddings client (BAAI/bge-m3 by default).
+
+    The ONNX backend runs the quantized encoder on ONNX Runtime's CPU
+    provider, which uses int8 dot-product kernels and fused attention.
+    The HF backend is kept as a fallback.
 
     Critical: force device='cpu' so we never touch broken CUDA kernels
     in this container. Your GPUs are sm_61/sm_50 and the torch wheel
@@ -35,24 +113,204 @@ def _get_embeddings() -> HuggingFaceEmbeddings:
     """
     global _embeddings
     if _embeddings is None:
-        _embeddings = HuggingFaceEmbeddings(
-            model_name=DEFAULT_EMBED_MODEL,
-            model_kwargs={"device": EMBED_DEVICE},
-            encode_kwargs={"normalize_embeddings": True},
-        )
+        if EMBED_BACKEND == "hf":
+            _embeddings = HuggingFaceEmbeddings(
+                model_name=DEFAULT_EMBED_MODEL,
+                model_kwargs={"device": EMBED_DEVICE},
+                # Large batches keep the encoder's GEMMs busy and amortise
+                # the per-call tokenizer/Python overhead across many chunks.
+                encode_kwargs={
+                    "normalize_embeddings": True,
+                    "batch_size": EMBED_BATCH_SIZE,
+                    "convert_to_numpy": True,
+                },
+            )
+        else:
+            _embeddings = OnnxEmbeddings(
+                model_id=ONNX_EMBED_MODEL,
+                file_name=ONNX_EMBED_FILE,
+                batch_size=EMBED_BATCH_SIZE,
+            )
     return _embeddings
 
 
+def _distance_strategy_for(index: faiss.Index) -> DistanceStrategy:
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return DistanceStrategy.MAX_INNER_PRODUCT
+    return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+
+def _configure_index(index: faiss.Index) -> faiss.Index:
+    """
+    Apply search-time parameters, which FAISS does not always persist.
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+    return index
+
+
+def _build_fp16_index(dim: int) -> faiss.Index:
+    """
+    Exact inner-product scan over vectors stored as fp16: half the RAM
+    and memory bandwidth of IndexFlatIP, with negligible recall loss.
+    FAISS still takes float32 input and converts on add.
+    """
+    return faiss.IndexScalarQuantizer(
+        dim,
+        faiss.ScalarQuantizer.QT_fp16,
+        faiss.METRIC_INNER_PRODUCT,
+    )
+
+
+def _build_index(dim: int) -> faiss.Index:
+    """
+    Build an empty index of the configured INDEX_TYPE.
+
+    PQ-based indexes come back untrained; see _maybe_train_index.
+    """
+    if INDEX_TYPE == "flat":
+        return faiss.IndexFlatIP(dim)
+
+    if INDEX_TYPE == "sqfp16":
+        return _build_fp16_index(dim)
+
+    if INDEX_TYPE == "pqfastscan":
+        return faiss.IndexPQFastScan(
+            dim,
+            dim // 2,
+            PQFS_NBITS,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+
+    if INDEX_TYPE == "ivfpq":
+        quantizer = faiss.IndexFlatIP(dim)
+        return _configure_index(
+            faiss.IndexIVFPQ(
+                quantizer,
+                dim,
+                IVF_NLIST,
+                dim // 4,
+                IVFPQ_NBITS,
+                faiss.METRIC_INNER_PRODUCT,
+            )
+        )
+
+    if INDEX_TYPE != "hnsw":
+        print(
+            f"[vector_store] WARNING: unknown FAISS_INDEX_TYPE={INDEX_TYPE!r}, "
+            "using hnsw."
+        )
+    # fp16 graph storage: half the RAM of IndexHNSWFlat, no training.
+    index = faiss.IndexHNSWSQ(
+        dim, faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT
+    )
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return _configure_index(index)
+
+
+def _maybe_train_index(vs: FAISS) -> None:
+    """
+    Swap the staging index for the trained target index once enough
+    vectors have been collected.
+
+    Vectors keep their positions, so index_to_docstore_id stays valid.
+    """
+    train_size = _TRAIN_SIZES.get(INDEX_TYPE)
+    if train_size is None:
+        return
+    # Older stores staged into IndexFlatIP; treat both as staging.
+    if type(vs.index) not in (faiss.IndexScalarQuantizer, faiss.IndexFlatIP):
+        return
+    ntotal = vs.index.ntotal
+    if ntotal < train_size:
+        return
+
+    vectors = vs.index.reconstruct_n(0, ntotal)
+    index = _build_index(vs.index.d)
+    index.train(vectors[:train_size])
+    index.add(vectors)
+    vs.index = index
+    print(
+        f"[vector_store] Trained {type(index).__name__} on "
+        f"{train_size} vectors ({ntotal} total)."
+    )
+
+
+def _read_index_files(
+    mmap: bool = False,
+) -> Tuple[faiss.Index, InMemoryDocstore, Dict[int, str]]:
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = _configure_index(faiss.read_index(str(INDEX_FILE), flags))
+    with DOCSTORE_FILE.open("rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return index, docstore, index_to_docstore_id
+
+
+def _hash_text(text: str) -> str:
+    return xxhash.xxh3_64_hexdigest(text.encode("utf-8"))
+
+
+def _load_chunk_hashes(
+    docstore: InMemoryDocstore,
+    index_to_docstore_id: Dict[int, str],
+) -> None:
+    """
+    Load the chunk hash sidecar, or rebuild it from the docstore for
+    stores saved before it existed (or in its older hash -> id form).
+    """
+    global _chunk_hashes
+    if CHUNK_HASHES_FILE.exists():
+        loaded = json.loads(CHUNK_HASHES_FILE.read_text(encoding="utf-8"))
+        if all(isinstance(v, dict) for v in loaded.values()):
+            _chunk_hashes = loaded
+            return
+
+    _chunk_hashes = {}
+    for pos, doc_id in index_to_docstore_id.items():
+        doc = docstore.search(doc_id)
+        if isinstance(doc, Document):
+            _chunk_hashes.setdefault(_hash_text(doc.page_content), {}).setdefault(
+                str(doc.metadata.get("source", "")), pos
+            )
+
+
+def _reconstruct_stored(vs: FAISS, positions: List[int]) -> Optional[np.ndarray]:
+    """
+    Read stored vectors back out of the index, or None if the layout
+    cannot reconstruct (IVF-PQ without a direct map).
+    """
+    try:
+        return vs.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    except RuntimeError:
+        return None
+
+
 def _load_vector_store() -> Optional[FAISS]:
+    """
+    Load the persisted store, memory-mapping the index if INDEX_MMAP.
+
+    Bypasses FAISS.load_local, which always reads the whole index into
+    RAM. Mapping only applies to IVF indexes (their inverted lists are
+    served straight from the file); FAISS ignores the flags for other
+    types and reads them normally, so those count as writable as loaded.
+    """
+    global _index_is_mmapped
     if not VECTOR_DIR.exists():
         return None
 
     try:
-        vs = FAISS.load_local(
-            str(VECTOR_DIR),
-            _get_embeddings(),
-            allow_dangerous_deserialization=True,
+        index, docstore, index_to_docstore_id = _read_index_files(mmap=INDEX_MMAP)
+        _load_chunk_hashes(docstore, index_to_docstore_id)
+        vs = FAISS(
+            embedding_function=_get_embeddings(),
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=_distance_strategy_for(index),
         )
+        _index_is_mmapped = INDEX_MMAP and isinstance(index, faiss.IndexIVF)
         print("[vector_store] Loaded existing FAISS index from disk.")
         return vs
     except Exception as e:
@@ -63,6 +321,22 @@ def _load_vector_store() -> Optional[FAISS]:
         return None
 
 
+def _ensure_writable(vs: FAISS) -> None:
+    """
+    Swap a memory-mapped, read-only index for an in-memory copy before
+    the first write. The docstore is reloaded alongside it so the two
+    stay consistent with what is on disk.
+    """
+    global _index_is_mmapped
+    if not _index_is_mmapped:
+        return
+
+    vs.index, vs.docstore, vs.index_to_docstore_id = _read_index_files()
+    _load_chunk_hashes(vs.docstore, vs.index_to_docstore_id)
+    _index_is_mmapped = False
+    print("[vector_store] Reloaded FAISS index into memory for writing.")
+
+
 def _create_empty_vector_store() -> FAISS:
     """
     Create a brand-new FAISS index.
@@ -72,28 +346,34 @@ def _create_empty_vector_store() -> FAISS:
     configured DEFAULT_EMBED_DIM.
     """
     INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    _chunk_hashes.clear()
     dim = DEFAULT_EMBED_DIM
 
     try:
         probe_vec = _get_embeddings().embed_query("dimension probe")
         dim = len(probe_vec)
-        print(f"[vector_store] Probed embedding dim from HF model: {dim}")
+        print(f"[vector_store] Probed embedding dim from model: {dim}")
     except Exception as e:
         print(
             "[vector_store] WARNING: could not probe embedding dimension, "
             f"defaulting to {dim}. Error: {e}"
         )
 
-    index = faiss.IndexFlatL2(dim)
+    index = _build_index(dim)
+    if not index.is_trained:
+        # Stage into an fp16 index until there is enough data to train on.
+        index = _build_fp16_index(dim)
+
     vs = FAISS(
         embedding_function=_get_embeddings(),
         index=index,
         docstore=InMemoryDocstore({}),
         index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
     )
     print(
-        f"[vector_store] Created new FAISS index with dim={dim} "
-        f"for model={DEFAULT_EMBED_MODEL}."
+        f"[vector_store] Created new FAISS {type(index).__name__} index "
+        f"with dim={dim} for model={DEFAULT_EMBED_MODEL}."
     )
     return vs
 
@@ -109,28 +389,148 @@ def get_vector_store() -> FAISS:
 
 
 def save_vector_store(vs: Optional[FAISS] = None) -> None:
+    """
+    Persist in FAISS.save_local's layout, but write each file under a
+    temporary name and rename it into place. Truncating a file that is
+    memory-mapped (here or in another worker) would crash that process.
+    """
+    global _dirty_count
     VECTOR_DIR.mkdir(parents=True, exist_ok=True)
     vs = vs or get_vector_store()
-    vs.save_local(str(VECTOR_DIR))
+    _ensure_writable(vs)
+
+    index_tmp = INDEX_FILE.with_name(INDEX_FILE.name + ".tmp")
+    faiss.write_index(vs.index, str(index_tmp))
+    os.replace(index_tmp, INDEX_FILE)
+
+    docstore_tmp = DOCSTORE_FILE.with_name(DOCSTORE_FILE.name + ".tmp")
+    with docstore_tmp.open("wb") as f:
+        pickle.dump((vs.docstore, vs.index_to_docstore_id), f)
+    os.replace(docstore_tmp, DOCSTORE_FILE)
+
+    hashes_tmp = CHUNK_HASHES_FILE.with_name(CHUNK_HASHES_FILE.name + ".tmp")
+    hashes_tmp.write_text(json.dumps(_chunk_hashes), encoding="utf-8")
+    os.replace(hashes_tmp, CHUNK_HASHES_FILE)
+    _dirty_count = 0
+
+
+@atexit.register
+def _save_pending_on_exit() -> None:
+    if _dirty_count and _vector_store is not None:
+        save_vector_store(_vector_store)
+
+
+def add_embeddings_fast(
+    vs: FAISS,
+    vectors: np.ndarray,
+    documents: List[Document],
+) -> None:
+    """
+    Append pre-computed (n, dim) vectors to the index and their documents
+    to the docstore, keeping index positions and docstore ids in step.
+
+    Bypasses vs.add_documents / add_embeddings, which re-embed or rebuild
+    the vectors from Python lists.
+    """
+    ids = [str(uuid4()) for _ in documents]
+    vs.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    start = vs.index.ntotal - len(documents)
+    for j, (doc_id, doc) in enumerate(zip(ids, documents)):
+        doc.id = doc_id
+        vs.index_to_docstore_id[start + j] = doc_id
+    vs.docstore.add(dict(zip(ids, documents)))
 
 
 def add_documents_to_vector_store(
     vs: FAISS,
     documents: List[Document],
-    persist: bool = True,
+    persist: bool = False,
 ) -> FAISS:
+    """
+    Embed and add documents. persist=True saves immediately; otherwise
+    the store is saved once PERSIST_EVERY documents are pending (and on
+    interpreter exit), so callers adding in batches should save at the
+    end themselves.
+
+    Each (source, chunk text) pair is stored once: a chunk whose text is
+    already indexed for the same source is skipped, whether it repeats
+    within this call or was added by an earlier one. The same text from
+    another source is stored again under that source, but each distinct
+    text is embedded only once and reused from the index afterwards.
+    """
+    global _dirty_count, _index_epoch
     if not documents:
         return vs
 
-    vs.add_documents(documents)
-    print(f"[vector_store] Added {len(documents)} documents to FAISS.")
+    _ensure_writable(vs)
+
+    keys: List[Tuple[str, str]] = []
+    new_docs: List[Document] = []
+    seen = set()
+    for doc in documents:
+        key = (_hash_text(doc.page_content), str(doc.metadata.get("source", "")))
+        if key in seen or key[1] in _chunk_hashes.get(key[0], {}):
+            continue
+        seen.add(key)
+        keys.append(key)
+        new_docs.append(doc)
+
+    skipped = len(documents) - len(new_docs)
+    if not new_docs:
+        print(f"[vector_store] Skipped {skipped} already-indexed documents.")
+        return vs
+
+    # Distinct texts in first-seen order; those already stored under
+    # another source are read back from the index instead of re-embedded.
+    distinct: Dict[str, str] = {}
+    for (h, _), doc in zip(keys, new_docs):
+        distinct.setdefault(h, doc.page_content)
+    reused = [h for h in distinct if h in _chunk_hashes]
+    parts: List[np.ndarray] = []
+    if reused:
+        stored = _reconstruct_stored(
+            vs, [next(iter(_chunk_hashes[h].values())) for h in reused]
+        )
+        if stored is None:
+            reused = []
+        else:
+            parts.append(stored)
+    reused_set = set(reused)
+    fresh = [h for h in distinct if h not in reused_set]
+    if fresh:
+        parts.append(
+            np.asarray(
+                _get_embeddings().embed_documents([distinct[h] for h in fresh]),
+                dtype=np.float32,
+            )
+        )
+    vectors = np.concatenate(parts)
+    # hash -> row of its vector in `vectors`
+    rows = {h: i for i, h in enumerate(reused + fresh)}
+
+    start = vs.index.ntotal
+    add_embeddings_fast(vs, vectors[[rows[h] for h, _ in keys]], new_docs)
+    for j, (h, source) in enumerate(keys):
+        _chunk_hashes.setdefault(h, {})[source] = start + j
+    _maybe_train_index(vs)
+    print(
+        f"[vector_store] Added {len(new_docs)} documents to FAISS "
+        f"({len(fresh)} embedded, {len(reused)} reused, "
+        f"{skipped} already indexed)."
+    )
 
-    if persist:
+    _index_epoch += 1
+    _dirty_count += len(new_docs)
+    if persist or _dirty_count >= PERSIST_EVERY:
         save_vector_store(vs)
 
     return vs
 
 
+def get_index_epoch() -> int:
+    return _index_epoch
+
+
 def count_documents_in_vector_store(vs: Optional[FAISS] = None) -> int:
     vs = vs or get_vector_store()
     try:
@@ -147,7 +547,7 @@ def retrieve_all_documents(vs: Optional[FAISS] = None) -> List[Document]:
 
 def get_vector_store_info(vs: Optional[FAISS] = None) -> Dict[str, Any]:
     vs = vs or get_vector_store()
-    index_type = type(vs.index).__name__
+    index_type = type(faiss.downcast_index(vs.index)).__name__
     dim = getattr(vs.index, "d", None)
     doc_count = count_documents_in_vector_store(vs)
     return {
@@ -157,9 +557,55 @@ def get_vector_store_info(vs: Optional[FAISS] = None) -> Dict[str, Any]:
     }
 
 
+def search_by_vectors(
+    vs: FAISS,
+    vectors: List[List[float]],
+    k: int = 5,
+) -> List[List[Document]]:
+    """
+    Top-k lookup for already-embedded queries, straight against the
+    FAISS index: one batched index.search for all rows, no re-embedding
+    and no LangChain wrapper in between. Returns one list per query.
+    """
+    if not len(vectors):
+        return []
+    xq = np.asarray(vectors, dtype="float32")
+    _, ids = vs.index.search(xq, k)
+
+    results: List[List[Document]] = []
+    for row in ids:
+        docs: List[Document] = []
+        for i in row:
+            if i < 0:
+                continue
+            doc = vs.docstore.search(vs.index_to_docstore_id[int(i)])
+            if isinstance(doc, Document):
+                docs.append(doc)
+        results.append(docs)
+    return results
+
+
+def search_questions(
+    questions: List[str],
+    k: int = 5,
+    vs: Optional[FAISS] = None,
+) -> List[List[Document]]:
+    """
+    Embed a batch of questions in one encoder call and search them in
+    one FAISS call.
+    """
+    vs = vs or get_vector_store()
+    return search_by_vectors(vs, _get_embeddings().embed_documents(questions), k)
+
+
 def search_vector_store(
     vs: FAISS,
     query: str,
     k: int = 5,
-):
-    return vs.similarity_search(query, k=k)
+) -> List[Document]:
+    """
+    Single-query search: embed once, then go straight to index.search
+    instead of through FAISS.similarity_search.
+    """
+    vec = _get_embeddings().embed_query(query)
+    return search_by_vectors(vs, [vec], k)[0]
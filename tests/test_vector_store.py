@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+from unittest import mock
+
+import numpy as np
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+
+    from app import vector_store
+except ImportError:  # faiss / langchain extras not installed
+    vector_store = None
+else:
+
+    class _CountingEmbeddings(Embeddings):
+        """Deterministic unit vectors per text; records every text embedded."""
+
+        def __init__(self) -> None:
+            self.embedded: List[str] = []
+
+        def _vector(self, text: str) -> List[float]:
+            seed = int(vector_store._hash_text(text), 16) % 2**32
+            v = np.random.default_rng(seed).standard_normal(16)
+            return (v / np.linalg.norm(v)).tolist()
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            self.embedded.extend(texts)
+            return [self._vector(t) for t in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            return self._vector(text)
+
+
+@unittest.skipIf(vector_store is None, "vector store dependencies not installed")
+class ChunkDedupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        index_dir = Path(tmp.name) / "vector_store"
+        self.embeddings = _CountingEmbeddings()
+        patcher = mock.patch.multiple(
+            vector_store,
+            VECTOR_DIR=index_dir,
+            INDEX_DIR=index_dir,
+            INDEX_FILE=index_dir / "index.faiss",
+            DOCSTORE_FILE=index_dir / "index.pkl",
+            CHUNK_HASHES_FILE=index_dir / "chunk_hashes.json",
+            _embeddings=self.embeddings,
+            _vector_store=None,
+            _chunk_hashes={},
+            _dirty_count=0,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vs = vector_store.get_vector_store()
+        self.embeddings.embedded.clear()
+
+    def _add(self, *docs: Document) -> None:
+        vector_store.add_documents_to_vector_store(self.vs, list(docs))
+
+    def _sources(self, text: str) -> List[str]:
+        return sorted(
+            d.metadata["source"]
+            for d in vector_store.retrieve_all_documents(self.vs)
+            if d.page_content == text
+        )
+
+    def test_shared_chunk_kept_per_source_across_batches(self) -> None:
+        boilerplate = "Copyright notice"
+        self._add(
+            Document(page_content=boilerplate, metadata={"source": "a.pdf"}),
+            Document(page_content=boilerplate, metadata={"source": "b.pdf"}),
+        )
+        self._add(Document(page_content=boilerplate, metadata={"source": "c.pdf"}))
+
+        self.assertEqual(self._sources(boilerplate), ["a.pdf", "b.pdf", "c.pdf"])
+        self.assertEqual(self.embeddings.embedded, [boilerplate])
+
+    def test_reingest_skips_within_and_across_batches(self) -> None:
+        header = "Chapter header"
+        self._add(
+            Document(page_content=header, metadata={"source": "a.pdf", "page": 1}),
+            Document(page_content=header, metadata={"source": "a.pdf", "page": 2}),
+        )
+        self._add(Document(page_content=header, metadata={"source": "a.pdf"}))
+
+        self.assertEqual(self._sources(header), ["a.pdf"])
+        self.assertEqual(vector_store.count_documents_in_vector_store(self.vs), 1)
+
+    def test_skip_map_survives_reload(self) -> None:
+        text = "Some chunk"
+        self._add(Document(page_content=text, metadata={"source": "a.pdf"}))
+        vector_store.save_vector_store(self.vs)
+
+        vector_store._vector_store = None
+        self.vs = vector_store.get_vector_store()
+        self._add(
+            Document(page_content=text, metadata={"source": "a.pdf"}),
+            Document(page_content=text, metadata={"source": "b.pdf"}),
+        )
+
+        self.assertEqual(self._sources(text), ["a.pdf", "b.pdf"])
+        self.assertEqual(self.embeddings.embedded, [text])
+
+
+if __name__ == "__main__":
+    unittest.main()